@@ -0,0 +1,7 @@
+# Optional Cython declarations for fill.py; the .py source stays plain Python.
+# Build in place with:  cythonize -i -3 fill.py
+# build_flowables is left undeclared: Cython does not support closures inside cpdef functions.
+
+cpdef str _preserve_spaces(object m)
+cpdef str _wrap_marked(str s, str marker, str open_tag, str close_tag)
+cpdef str _inline_format(str s)
@@ -1,30 +1,118 @@
 import argparse
+import functools
+from collections import deque
 from io import BytesIO
 from pathlib import Path
 import re
-import copy as _copy
 
-from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.units import mm
 from reportlab.platypus import Frame, Paragraph, ListFlowable, ListItem, Spacer, KeepTogether, PageBreak
 from reportlab.pdfgen.canvas import Canvas
-from pypdf import PdfReader, PdfWriter
+import pikepdf
+
+
+_RE_MULTISPACE = re.compile(r' {2,}')
+
+# Line kinds produced by _classify
+_BLANK, _H1, _H2, _BULLET, _NUMBER, _PARA = range(6)
+
+# Shared parent for the MoM styles, instead of building getSampleStyleSheet() (~20 styles) for
+# Normal/Heading1/Heading2. Of their settings only Heading1's spaceAfter=6 was not overridden,
+# so MoMH1 now sets it explicitly.
+_BASE_STYLE = ParagraphStyle("MoMBase", fontName="Times-Roman", fontSize=12)
+
+# ListFlowable options that do not depend on the document styles
+_BULLET_KW = dict(bulletType='bullet', leftPadding=12, bulletFontName='Times-Roman')
+_NUMBER_KW = dict(bulletType='1', bulletFormat='%s.', leftPadding=12, bulletFontName='Times-Roman')
+
+
+# Expected, user-fixable problems (empty template, margins leaving no content area). main() turns
+# these into SystemExit; anything else (e.g. reportlab markup errors) keeps its traceback.
+class LayoutSetupError(ValueError):
+    pass
+
+
+# run length -> HTML, so repeated runs of the same width (e.g. uniform indentation) reuse one string
+_NBSP_CACHE: dict[int, str] = {}
+
+
+def _preserve_spaces(m):
+    n = len(m.group(0))
+    html = _NBSP_CACHE.get(n)
+    if html is None:
+        html = _NBSP_CACHE[n] = '&nbsp;' * (n - 1) + ' '
+    return html
+
+
+# Same as matching r'^[-*]\s+' / r'^\d+\.\s+', but with plain string tests instead of the regex engine.
+# Returns (_BULLET | _NUMBER, stripped body), or None for anything else.
+def _list_item(line: str):
+    first = line[:1]
+    if first == '-' or first == '*':
+        if line[1:2].isspace():
+            return _BULLET, line[1:].strip()
+    elif first.isdigit():
+        head, _, tail = line.partition('.')
+        if head.isdecimal() and tail[:1].isspace():
+            return _NUMBER, tail.strip()
+    return None
+
+
+# Returns (kind, payload, stripped line). The payload is the heading text for _H1/_H2,
+# the item body for _BULLET/_NUMBER and the unstripped line for _PARA (leading spaces matter there).
+def _classify(line: str):
+    stripped = line.strip()
+    if not stripped:
+        return _BLANK, '', stripped
+    if line.startswith('# '):
+        return _H1, line[2:].strip(), stripped
+    if line.startswith('## '):
+        return _H2, line[3:].strip(), stripped
+    item = _list_item(line)
+    if item is not None:
+        return item[0], item[1], stripped
+    return _PARA, line, stripped
+
+
+# Single left-to-right scan with str.find, equivalent to re.sub(r'M(.+?)M', r'<tag>\1</tag>', s)
+# for a one-line s: the content must be non-empty and ends at the next marker.
+def _wrap_marked(s: str, marker: str, open_tag: str, close_tag: str) -> str:
+    start = s.find(marker)
+    if start < 0:
+        return s
+    n = len(marker)
+    out = []
+    pos = 0
+    while start >= 0:
+        end = s.find(marker, start + n + 1)
+        if end < 0:
+            # no closing marker after this one, so none after any later opening marker either
+            break
+        out.append(s[pos:start])
+        out.append(open_tag)
+        out.append(s[start + n:end])
+        out.append(close_tag)
+        pos = end + n
+        start = s.find(marker, pos)
+    out.append(s[pos:])
+    return ''.join(out)
 
 
 def _inline_format(s: str) -> str:
-    def _preserve_spaces(m):
-        n = len(m.group(0))
-        return '&nbsp;' * (n - 1) + ' '
-
-    s = re.sub(r' {2,}', _preserve_spaces, s)
-    s = re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', s)
-    s = re.sub(r'\*(.+?)\*', r'<i>\1</i>', s)
+    # most lines carry no markup at all; plain substring checks are far cheaper than any scan
+    if '  ' in s:
+        s = _RE_MULTISPACE.sub(_preserve_spaces, s)
+    if '*' in s:
+        s = _wrap_marked(s, '**', '<b>', '</b>')
+        s = _wrap_marked(s, '*', '<i>', '</i>')
     return s
 
 
 def build_flowables(text: str, body_style: ParagraphStyle, h1_style: ParagraphStyle, h2_style: ParagraphStyle):
     flowables = []
-    lines = text.splitlines()
+    # classify lines lazily, keeping a one-token lookahead
+    tokens = map(_classify, text.splitlines())
 
     current_list = None
     current_list_type = None
@@ -35,11 +123,8 @@ def build_flowables(text: str, body_style: ParagraphStyle, h1_style: ParagraphSt
         nonlocal current_list, current_list_type
         if not current_list:
             return
-        items = [ListItem(item, leftIndent=0) for item in current_list]
-        if current_list_type == 'bullet':
-            lf = ListFlowable(items, bulletType='bullet', leftPadding=12, bulletFontName='Times-Roman', bulletFontSize=body_style.fontSize)
-        else:
-            lf = ListFlowable(items, bulletType='1', bulletFormat='%s.', leftPadding=12, bulletFontName='Times-Roman', bulletFontSize=body_style.fontSize)
+        kw = _BULLET_KW if current_list_type == _BULLET else _NUMBER_KW
+        lf = ListFlowable([ListItem(item, leftIndent=0) for item in current_list], bulletFontSize=body_style.fontSize, **kw)
         to_container.append(lf)
         current_list = None
         current_list_type = None
@@ -54,13 +139,11 @@ def build_flowables(text: str, body_style: ParagraphStyle, h1_style: ParagraphSt
             flowables.extend(current_section)
         current_section = None
 
-    i = 0
-    while i < len(lines):
-        raw = lines[i]
-        line = raw.rstrip('\n')
-        nxt = lines[i+1] if i+1 < len(lines) else ''
+    upcoming = next(tokens, None)
+    while upcoming is not None:
+        (kind, payload, stripped), upcoming = upcoming, next(tokens, None)
 
-        if not line.strip():
+        if kind == _BLANK:
             if current_list:
                 if current_section is not None:
                     flush_list(current_section)
@@ -70,66 +153,47 @@ def build_flowables(text: str, body_style: ParagraphStyle, h1_style: ParagraphSt
                 current_section.append(Spacer(1, 6))
             else:
                 flowables.append(Spacer(1, 6))
-            i += 1
             continue
 
-        if line.startswith('# '):
+        if kind == _H1:
             if current_list:
                 flush_list(current_section if current_section is not None else flowables)
             flush_section()
-            flowables.append(Paragraph(_inline_format(line[2:].strip()), h1_style))
-            i += 1
+            flowables.append(Paragraph(_inline_format(payload), h1_style))
             continue
 
-        if line.startswith('## '):
+        if kind == _H2:
             if current_list:
                 flush_list(current_section if current_section is not None else flowables)
             flush_section()
-            current_section = [Paragraph(_inline_format(line[3:].strip()), h2_style)]
-            i += 1
+            current_section = [Paragraph(_inline_format(payload), h2_style)]
             continue
 
-        # detect colon-labeled sections
-        m_bullet_next = re.match(r'^[\-\*]\s+.*', nxt.strip())
-        m_number_next = re.match(r'^\d+\.\s+.*', nxt.strip())
-        if line.strip().endswith(':') and (m_bullet_next or m_number_next):
+        # detect colon-labeled sections (the next line only has to look like a list item once stripped)
+        if stripped.endswith(':') and upcoming is not None and _list_item(upcoming[2]):
             if current_list:
                 flush_list(current_section if current_section is not None else flowables)
             flush_section()
-            current_section = [Paragraph(_inline_format(line.strip()), body_style)]
-            i += 1
+            current_section = [Paragraph(_inline_format(stripped), body_style)]
             continue
 
-        m_bullet = re.match(r'^[\-\*]\s+(.*)', line)
-        m_number = re.match(r'^(\d+)\.\s+(.*)', line)
-        if m_bullet:
-            if current_list_type != 'bullet':
-                if current_list:
-                    flush_list(current_section if current_section is not None else flowables)
-                current_list_type = 'bullet'
-                current_list = []
-            current_list.append(Paragraph(_inline_format(m_bullet.group(1).strip()), body_style))
-            i += 1
-            continue
-        if m_number:
-            if current_list_type != 'number':
+        if kind != _PARA:
+            if current_list_type != kind:
                 if current_list:
                     flush_list(current_section if current_section is not None else flowables)
-                current_list_type = 'number'
+                current_list_type = kind
                 current_list = []
-            current_list.append(Paragraph(_inline_format(m_number.group(2).strip()), body_style))
-            i += 1
+            current_list.append(Paragraph(_inline_format(payload), body_style))
             continue
 
         # normal paragraph
         if current_list:
             flush_list(current_section if current_section is not None else flowables)
-        p_html = _inline_format(line)
+        p_html = _inline_format(payload)
         if current_section is not None:
             current_section.append(Paragraph(p_html.strip(), body_style))
         else:
             flowables.append(Paragraph(p_html.strip(), body_style))
-        i += 1
 
     if current_list:
         flush_list(current_section if current_section is not None else flowables)
@@ -150,39 +214,32 @@ def estimate_height(flow_items, width, max_height=None):
     return total
 
 
-def make_overlay_pages(page_width, page_height, left, bottom, content_width, content_height, flowables):
-    overlays = []
-    work = flowables[:]
+def make_overlay_pdf(page_width, page_height, left, bottom, content_width, content_height, flowables):
+    # Frame.addFromList consumes its list with `del drawlist[0]`; a deque makes that O(1) instead of O(n)
+    work = deque(flowables)
+
+    # All overlay pages are drawn on one canvas and serialised once into a single overlay document
+    buf = BytesIO()
+    canv = Canvas(buf, pagesize=(page_width, page_height))
+    pages_drawn = 0
 
-    # Helper to estimate height for a collection of flowables
-    def estimate_height(flow_items, width, max_h=None):
-        total = 0
-        for f in flow_items:
-            try:
-                w, h = f.wrap(width, max_h if max_h is not None else 1e6)
-            except Exception:
-                return float('inf')
-            total += h
-            if max_h is not None and total > max_h:
-                return total
-        return total
+    # Only SECTION markers past the head of the list need flattening; once done, none are reintroduced
+    needs_flatten = any(isinstance(x, tuple) and x[0] == 'SECTION' for x in flowables[1:])
 
     while work:
-        if len(work) > 1:
-            new_work = []
-            start = 0
+        if needs_flatten and len(work) > 1:
+            new_work = deque()
+            rest = iter(work)
             if isinstance(work[0], tuple) and work[0][0] == 'SECTION':
-                new_work.append(work[0])
-                start = 1
-            for item in work[start:]:
+                new_work.append(next(rest))
+            for item in rest:
                 if isinstance(item, tuple) and item[0] == 'SECTION':
                     new_work.extend(item[1])
                 else:
                     new_work.append(item)
             work = new_work
+            needs_flatten = False
 
-        buf = BytesIO()
-        canv = Canvas(buf, pagesize=(page_width, page_height))
         frame = Frame(left, bottom, content_width, content_height, leftPadding=6, rightPadding=6, showBoundary=0)
 
         # If the next item is a SECTION marker, try to keep it together on this new page if it will fit
@@ -191,23 +248,126 @@ def make_overlay_pages(page_width, page_height, left, bottom, content_width, con
             est = estimate_height(items, content_width, content_height)
             if est <= content_height:
                 # The whole section fits on one page, so add it first
-                frame.addFromList(items[:], canv)
+                frame.addFromList(deque(items), canv)
                 # remove the section marker
-                work.pop(0)
+                work.popleft()
                 # Let the frame fill the rest of the page from remaining work
                 frame.addFromList(work, canv)
             else:
                 # Section is larger than a page — unwrap it so it can be split naturally
-                work = items + work[1:]
+                work.popleft()
+                work.extendleft(reversed(items))
                 frame.addFromList(work, canv)
         else:
             # Normal case: let reportlab consume as many flowables as fit on the page
             frame.addFromList(work, canv)
 
-        canv.save()
-        buf.seek(0)
-        overlays.append(buf)
-    return overlays
+        canv.showPage()
+        pages_drawn += 1
+
+    if not pages_drawn:
+        return pikepdf.new()
+    canv.save()
+    buf.seek(0)
+    return pikepdf.open(buf)
+
+
+def _page_text(page):
+    # rough text of a page for --debug output: the string operands of its text-showing operators,
+    # with a line break wherever the text position is moved. reportlab's standard fonts use
+    # WinAnsiEncoding, so the raw bytes are decoded as cp1252 (list bullets come out as '\x7f').
+    parts = []
+    for operands, op in pikepdf.parse_content_stream(page, 'Tj TJ T* Td TD Tm'):
+        if op not in (pikepdf.Operator('Tj'), pikepdf.Operator('TJ')):
+            if parts and parts[-1] != '\n':
+                parts.append('\n')
+            continue
+        for operand in operands:
+            items = operand if isinstance(operand, pikepdf.Array) else [operand]
+            parts.extend(bytes(x).decode('cp1252', errors='replace') for x in items if isinstance(x, pikepdf.String))
+    return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_template(path_str, mtime_ns):
+    # mtime_ns is only part of the cache key, so an edited template file is parsed again.
+    # Returns the open Pdf (pikepdf pages are only valid while their Pdf is alive) and a form XObject
+    # of its first page for render(); building the form adds an object to the Pdf, so it is done once
+    # per cached template. The file is read into memory so cached entries hold no file handle (which on
+    # Windows would block editing the template).
+    tpl = pikepdf.open(BytesIO(Path(path_str).read_bytes()))
+    if not tpl.pages:
+        raise LayoutSetupError("Template PDF has no pages")
+    return tpl, tpl.pages[0].as_form_xobject()
+
+
+def render(template_page, text, left=50.0, right=50.0, top=120.0, bottom=100.0,
+           font_size=12.0, h1_size=16.0, h2_size=14.0, debug=False, template_form=None):
+    # Lay out `text` over `template_page` and return the finished PDF bytes and the number of pages.
+    # When rendering repeatedly from one template, pass the page's form XObject as `template_form`
+    # (see _load_template): creating one here adds a new object to the template's Pdf on every call.
+    llx, lly, urx, ury = (float(v) for v in template_page.mediabox)
+    page_w = urx - llx
+    page_h = ury - lly
+
+    content_w = page_w - left - right
+    content_h = page_h - top - bottom
+    if content_w <= 0 or content_h <= 0:
+        raise LayoutSetupError("Invalid margins: content area is not positive. Adjust top/bottom/left/right values.")
+
+    body = ParagraphStyle(
+        "MoMBody",
+        parent=_BASE_STYLE,
+        fontName="Times-Roman",
+        fontSize=font_size,
+        leading=font_size * 1.25,
+    )
+    h1 = ParagraphStyle(
+        "MoMH1",
+        parent=_BASE_STYLE,
+        fontName="Times-Bold",
+        fontSize=h1_size,
+        leading=h1_size + 4,
+        spaceAfter=6,
+        alignment=1,  # centered headings
+    )
+    h2 = ParagraphStyle(
+        "MoMH2",
+        parent=_BASE_STYLE,
+        fontName="Times-Bold",
+        fontSize=h2_size,
+        leading=h2_size + 2,
+        spaceBefore=6,
+        spaceAfter=6,
+    )
+
+    flowables = build_flowables(text, body, h1, h2)
+
+    if debug:
+        print(f"DEBUG: generated {len(flowables)} flowables")
+        for i, f in enumerate(flowables[:10], 1):
+            print(f"  {i}: {type(f).__name__}")
+
+    overlay_pdf = make_overlay_pdf(page_w, page_h, left, bottom, content_w, content_h, flowables)
+    page_count = len(overlay_pdf.pages)
+
+    # Put the template beneath each overlay page. A single form XObject is used for all pages,
+    # so pikepdf copies the template into the overlay document once and every page shares it.
+    if template_form is None:
+        template_form = template_page.as_form_xobject()
+    for i, overlay_page in enumerate(overlay_pdf.pages, 1):
+        if debug:
+            # extract overlay text samples
+            ot = _page_text(overlay_page)
+            print(f"  overlay {i} text (first140): {ot.strip()[:140]!a}")
+        overlay_page.add_underlay(template_form)
+
+    if debug:
+        print(f"DEBUG: created {page_count} overlay page(s)")
+
+    out = BytesIO()
+    overlay_pdf.save(out)
+    return out.getvalue(), page_count
 
 
 def main():
@@ -245,23 +405,10 @@ def main():
             break
     if template_path is None:
         raise SystemExit(f"Template PDF not found. Tried: {', '.join(candidate_templates)}")
-
-    tpl_reader = PdfReader(str(template_path))
-    if not tpl_reader.pages:
-        raise SystemExit("Template PDF has no pages")
-    template_page = tpl_reader.pages[0]
-    media = template_page.mediabox
-    page_w = float(media.width)
-    page_h = float(media.height)
-
-    left = args.left
-    right = args.right
-    top = args.top
-    bottom = args.bottom
-    content_w = page_w - left - right
-    content_h = page_h - top - bottom
-    if content_w <= 0 or content_h <= 0:
-        raise SystemExit("Invalid margins: content area is not positive. Adjust top/bottom/left/right values.")
+    try:
+        template_pdf, template_form = _load_template(str(template_path), template_path.stat().st_mtime_ns)
+    except LayoutSetupError as e:
+        raise SystemExit(str(e))
 
     # Resolve input path: try provided path, then try common candidates
     candidate_inputs = [
@@ -285,68 +432,27 @@ def main():
     with open(input_path, "r", encoding="utf-8") as f:
         txt = f.read()
 
-    styles = getSampleStyleSheet()
-    body_size = args.font_size
-    h1_size = args.h1_size
-    h2_size = args.h2_size
-
-    body = ParagraphStyle(
-        "MoMBody",
-        parent=styles["Normal"],
-        fontName="Times-Roman",
-        fontSize=body_size,
-        leading=body_size * 1.25,
-    )
-    h1 = ParagraphStyle(
-        "MoMH1",
-        parent=styles["Heading1"],
-        fontName="Times-Bold",
-        fontSize=h1_size,
-        leading=h1_size + 4,
-        alignment=1,  # centered headings
-    )
-    h2 = ParagraphStyle(
-        "MoMH2",
-        parent=styles["Heading2"],
-        fontName="Times-Bold",
-        fontSize=h2_size,
-        leading=h2_size + 2,
-        spaceBefore=6,
-        spaceAfter=6,
-    )
-
-    flowables = build_flowables(txt, body, h1, h2)
-
-    if args.debug:
-        print(f"DEBUG: generated {len(flowables)} flowables")
-        for i, f in enumerate(flowables[:10], 1):
-            print(f"  {i}: {type(f).__name__}")
-
-    overlays = make_overlay_pages(page_w, page_h, left, bottom, content_w, content_h, flowables)
-
-    if args.debug:
-        print(f"DEBUG: created {len(overlays)} overlay page(s)")
-        # extract overlay text samples
-        for i, buf in enumerate(overlays, 1):
-            overlay_reader = PdfReader(buf)
-            ot = overlay_reader.pages[0].extract_text() or ""
-            print(f"  overlay {i} text (first140): {ot.strip()[:140]!r}")
-
-    writer = PdfWriter()
-
-    # Merge overlay and template
-    for buf in overlays:
-        overlay_reader = PdfReader(buf)
-        overlay_page = overlay_reader.pages[0]
-        # copy overlay and merge the template beneath it
-        page = _copy.deepcopy(overlay_page)
-        page.merge_page(_copy.deepcopy(template_page))
-        writer.add_page(page)
+    try:
+        data, page_count = render(
+            template_pdf.pages[0],
+            txt,
+            left=args.left,
+            right=args.right,
+            top=args.top,
+            bottom=args.bottom,
+            font_size=args.font_size,
+            h1_size=args.h1_size,
+            h2_size=args.h2_size,
+            debug=args.debug,
+            template_form=template_form,
+        )
+    except LayoutSetupError as e:
+        raise SystemExit(str(e))
 
     with open(args.output, "wb") as out_f:
-        writer.write(out_f)
+        out_f.write(data)
 
-    print(f"Wrote {len(overlays)} page(s) to {args.output}")
+    print(f"Wrote {page_count} page(s) to {args.output}")
 
 
 if __name__ == "__main__":